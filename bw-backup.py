@@ -1,54 +1,65 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 import logging
 import os
 import shutil
 import subprocess
 import sys
-import tempfile
-from datetime import datetime
-
-from utils.backup_utils import BackupManager, setup_logging, validate_config
-
-
-# Check if a command exists
-def is_command_available(command):
-    return shutil.which(command) is not None
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.backup_utils import (
+    BackupManager,
+    load_config,
+    setup_logging,
+    shutdown_logging,
+    validate_config,
+)
+
+REQUIRED_KEYS = frozenset(
+    {
+        "BW_CLIENTID",
+        "BW_CLIENTSECRET",
+        "BW_PASSWORD",
+        "BACKUP_DIR_PATH",
+        "ZIP_PASSWORD",
+        "MAX_BACKUPS",
+    }
+)
 
 
 # Determine which bw command to use
 def get_bw_command():
-    if is_command_available("bw"):
+    # Resolve the executable once and invoke it by absolute path afterwards
+    bw_path = shutil.which("bw")
+    if bw_path:
         logging.info("Using locally installed Bitwarden CLI (bw).")
-        return ["bw"]
-    elif is_command_available("npx"):
+        return [bw_path]
+
+    npx_path = shutil.which("npx")
+    if npx_path:
         logging.info("Using Bitwarden CLI via npx (npx @bitwarden/cli).")
-        return ["npx", "--yes", "@bitwarden/cli"]
-    else:
-        logging.error(
-            "Neither bw nor npx is available. Please install Bitwarden CLI or npx."
-        )
-        sys.exit(1)
+        return [npx_path, "--yes", "@bitwarden/cli"]
 
+    logging.error(
+        "Neither bw nor npx is available. Please install Bitwarden CLI or npx."
+    )
+    sys.exit(1)
+
+
+# Stream the output of `bw export` in fixed-size chunks
+def read_export(export_proc, chunk_size=64 * 1024):
+    for chunk in iter(lambda: export_proc.stdout.read(chunk_size), b""):
+        yield chunk
+    if export_proc.wait() != 0:
+        raise RuntimeError("Failed to export the vault")
 
-def main(args):
-    config_file_path = os.path.abspath(args.config)
 
-    with open(config_file_path, "r") as f:
-        config = json.load(f)
+def main(args):
+    config = load_config(args.config)
 
     # Validate configuration
-    required_keys = [
-        "BW_CLIENTID",
-        "BW_CLIENTSECRET",
-        "BW_PASSWORD",
-        "BACKUP_DIR_PATH",
-        "ZIP_PASSWORD",
-        "MAX_BACKUPS",
-    ]
-    is_valid, error_msg = validate_config(config, required_keys)
+    is_valid, error_msg = validate_config(config, REQUIRED_KEYS)
     if not is_valid:
         logging.error(f"Configuration validation failed: {error_msg}")
         sys.exit(1)
@@ -65,122 +76,115 @@ def main(args):
     )
     verify_backups = config.get("VERIFY_BACKUPS", True)
     retention_policy = config.get("RETENTION_POLICY")
+    compression_level = config.get("COMPRESSION_LEVEL", 6)
 
     # Setup logging
     setup_logging(log_file_path, level=logging.INFO)
 
-    # Initialize backup manager
-    backup_manager = BackupManager(
-        backup_dir=backup_dir_path,
-        backup_prefix="bitwarden_backup",
-        zip_password=zip_password,
-        max_backups=max_backups,
-        verify_backups=verify_backups,
-        retention_policy=retention_policy,
-    )
-
-    # Ensure the backup directory exists
-    os.makedirs(backup_dir_path, exist_ok=True)
-
-    # Create temporary directory for intermediate files
-    temp_dir = tempfile.mkdtemp(prefix="bw-backup-")
-    logging.info(f"Using temporary directory: {temp_dir}")
+    # Get the appropriate bw command
+    bw_cmd = get_bw_command()
+
+    # Log in to Bitwarden
+    logging.info("Logging into Bitwarden...")
+    login_env = {
+        **os.environ,
+        "BW_CLIENTID": bw_clientid,
+        "BW_CLIENTSECRET": bw_clientsecret,
+    }
+    if subprocess.run(bw_cmd + ["login", "--apikey"], env=login_env).returncode != 0:
+        logging.error("Failed to login to Bitwarden")
+        sys.exit(1)
 
+    # Unlock the vault
+    logging.info("Unlocking the vault...")
+    # Hand the master password over a pipe so it never shows up in the
+    # environment of the bw process (/proc/<pid>/environ)
+    password_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "w") as f:
+        f.write(bw_password)
     try:
-        # Get the appropriate bw command
-        bw_cmd = get_bw_command()
-
-        # Log in to Bitwarden
-        logging.info("Logging into Bitwarden...")
-        login_env = os.environ.copy()
-        login_env["BW_CLIENTID"] = bw_clientid
-        login_env["BW_CLIENTSECRET"] = bw_clientsecret
-        if (
-            subprocess.run(bw_cmd + ["login", "--apikey"], env=login_env).returncode
-            != 0
-        ):
-            logging.error("Failed to login to Bitwarden")
-            sys.exit(1)
-
-        # Unlock the vault
-        logging.info("Unlocking the vault...")
-        unlock_env = os.environ.copy()
-        unlock_env["BW_PASSWORD"] = bw_password
         result = subprocess.run(
-            bw_cmd + ["unlock", "--passwordenv", "BW_PASSWORD", "--raw"],
+            bw_cmd + ["unlock", "--passwordfile", f"/dev/fd/{password_fd}", "--raw"],
             capture_output=True,
-            text=True,
-            env=unlock_env,
+            pass_fds=(password_fd,),
+        )
+    finally:
+        os.close(password_fd)
+    if result.returncode != 0:
+        logging.error("Failed to unlock the vault")
+        sys.exit(1)
+    session = result.stdout.strip().decode("ascii")
+    logging.info("Vault unlocked successfully.")
+
+    # Sync the vault while the backup directory is prepared locally
+    logging.info("Syncing the vault...")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sync_future = executor.submit(
+            subprocess.run, bw_cmd + ["sync", "--session", session]
+        )
+
+        # Initialize backup manager (creates the backup directory)
+        backup_manager = BackupManager(
+            backup_dir=backup_dir_path,
+            backup_prefix="bitwarden_backup",
+            zip_password=zip_password,
+            max_backups=max_backups,
+            verify_backups=verify_backups,
+            retention_policy=retention_policy,
+            compression_level=compression_level,
+        )
+
+    if sync_future.result().returncode != 0:
+        logging.error("Failed to sync the vault")
+        sys.exit(1)
+
+    # Export the vault straight into an encrypted backup
+    logging.info("Exporting vault to encrypted backup...")
+    export_proc = subprocess.Popen(
+        bw_cmd + ["export", "--format", "json", "--session", session, "--raw"],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        backup_path, metadata = backup_manager.create_encrypted_backup_from_stream(
+            read_export(export_proc), extension=".json"
+        )
+        logging.info(
+            f"Backup created successfully: {metadata['filename']} "
+            f"({metadata['size']} bytes, checksum: {metadata['checksum'][:16]}...)"
         )
-        if result.returncode != 0:
-            logging.error("Failed to unlock the vault")
-            sys.exit(1)
-        session = result.stdout.strip()
-        logging.info("Vault unlocked successfully.")
-
-        # Sync the vault
-        logging.info("Syncing the vault...")
-        if subprocess.run(bw_cmd + ["sync", "--session", session]).returncode != 0:
-            logging.error("Failed to sync the vault")
-            sys.exit(1)
-
-        # Export the vault
-        timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        backup_file = os.path.join(temp_dir, f"bitwarden_backup_{timestamp}.json")
-        logging.info(f"Exporting vault to {backup_file}...")
-        if (
-            subprocess.run(
-                bw_cmd
-                + [
-                    "export",
-                    "--output",
-                    backup_file,
-                    "--format",
-                    "json",
-                    "--session",
-                    session,
-                ]
-            ).returncode
-            != 0
-        ):
-            logging.error("Failed to export the vault")
-            sys.exit(1)
-
-        # Create encrypted backup using BackupManager
-        logging.info("Creating encrypted backup...")
-        try:
-            backup_path, metadata = backup_manager.create_encrypted_backup(
-                backup_file, is_file=True
-            )
-            logging.info(
-                f"Backup created successfully: {metadata['filename']} "
-                f"({metadata['size']} bytes, checksum: {metadata['checksum'][:16]}...)"
-            )
-        except Exception as e:
-            logging.error(f"Failed to create encrypted backup: {e}")
-            sys.exit(1)
-        finally:
-            # Remove plain backup file
-            if os.path.exists(backup_file):
-                os.remove(backup_file)
-                logging.info("Plain backup file removed after encryption.")
-
-        # Log out from Bitwarden
+    except Exception as e:
+        logging.error(f"Failed to create encrypted backup: {e}")
+        sys.exit(1)
+    finally:
+        export_proc.stdout.close()
+        export_proc.wait()
+
+    # Rotate backups
+    logging.info("Rotating backups...")
+    try:
+        backup_manager.rotate_backups()
+    except Exception as e:
+        logging.error(f"Failed to rotate backups: {e}")
+        # Still log out, but keep the failure in the exit status
         logging.info("Logging out from Bitwarden...")
         if subprocess.run(bw_cmd + ["logout"]).returncode != 0:
             logging.error("Failed to log out from Bitwarden")
-            sys.exit(1)
+        sys.exit(1)
 
-        # Rotate backups
-        logging.info("Rotating backups...")
-        backup_manager.rotate_backups()
+    logging.info("Backup completed successfully.")
 
-        logging.info("Backup completed successfully.")
-    finally:
-        # Clean up temporary directory
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            logging.info(f"Cleaned up temporary directory: {temp_dir}")
+    # Log out from Bitwarden as the last step, replacing this process with
+    # `bw logout` (its exit status becomes the script's exit status)
+    logging.info("Logging out from Bitwarden...")
+    shutdown_logging()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.execv(bw_cmd[0], bw_cmd + ["logout"])
+    except OSError as e:
+        setup_logging(log_file_path, level=logging.INFO)
+        logging.error(f"Failed to log out from Bitwarden: {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,27 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 import logging
 import os
 import sys
 
-from utils.backup_utils import BackupManager, setup_logging, validate_config
+from utils.backup_utils import (
+    BackupManager,
+    load_config,
+    setup_logging,
+    validate_config,
+)
 
+REQUIRED_KEYS = frozenset(
+    {"VAULT_PATH", "BACKUP_DIR_PATH", "ZIP_PASSWORD", "MAX_BACKUPS"}
+)
 
-def main(args):
-    config_file_path = os.path.abspath(args.config)
 
-    with open(config_file_path, "r") as f:
-        config = json.load(f)
+def main(args):
+    config = load_config(args.config)
 
     # Validate configuration
-    required_keys = ["VAULT_PATH", "BACKUP_DIR_PATH", "ZIP_PASSWORD", "MAX_BACKUPS"]
-    is_valid, error_msg = validate_config(config, required_keys)
+    is_valid, error_msg = validate_config(config, REQUIRED_KEYS)
     if not is_valid:
         logging.error(f"Configuration validation failed: {error_msg}")
         sys.exit(1)
@@ -32,6 +36,8 @@ def main(args):
     )
     verify_backups = config.get("VERIFY_BACKUPS", True)
     retention_policy = config.get("RETENTION_POLICY")
+    compression_level = config.get("COMPRESSION_LEVEL", 6)
+    deduplicate = config.get("DEDUPLICATE_BACKUPS", False)
 
     # Setup logging
     setup_logging(log_file_path, level=logging.INFO)
@@ -53,6 +59,8 @@ def main(args):
         max_backups=max_backups,
         verify_backups=verify_backups,
         retention_policy=retention_policy,
+        compression_level=compression_level,
+        deduplicate=deduplicate,
     )
 
     try:
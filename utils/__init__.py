@@ -2,6 +2,18 @@
 Backup utilities package.
 """
 
-from .backup_utils import BackupManager, setup_logging, validate_config
+from .backup_utils import (
+    BackupManager,
+    load_config,
+    setup_logging,
+    shutdown_logging,
+    validate_config,
+)
 
-__all__ = ["BackupManager", "setup_logging", "validate_config"]
+__all__ = [
+    "BackupManager",
+    "load_config",
+    "setup_logging",
+    "shutdown_logging",
+    "validate_config",
+]
@@ -4,21 +4,21 @@ Backup Manager CLI - Utility for managing and inspecting backups.
 """
 
 import argparse
-import json
 import os
 import sys
 from datetime import datetime
 
-from .backup_utils import BackupManager, setup_logging
+from .backup_utils import BackupManager, load_config, setup_logging
+
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
 
 
 def format_size(size_bytes: int) -> str:
     """Format file size in human-readable format."""
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} PB"
+    # Each unit is 2**10 times the previous one, so the unit follows
+    # directly from the bit length instead of repeated division
+    unit = min(max(size_bytes.bit_length() - 1, 0) // 10, len(SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * unit)):.2f} {SIZE_UNITS[unit]}"
 
 
 def list_backups(backup_manager: BackupManager):
@@ -62,10 +62,10 @@ def show_backup_info(backup_manager: BackupManager, filename: str):
     print(f"  Verified:   {'Yes' if info.get('verified', False) else 'No'}")
 
 
-def verify_backups(backup_manager: BackupManager):
+def verify_backups(backup_manager: BackupManager, deep: bool = False):
     """Verify integrity of all backups."""
     print("Verifying backups...")
-    results = backup_manager.verify_all_backups()
+    results = backup_manager.verify_all_backups(deep=deep)
 
     verified = sum(1 for v in results.values() if v)
     total = len(results)
@@ -107,13 +107,17 @@ def main():
         type=str,
         help="Backup filename (required for 'info' action)",
     )
+    parser.add_argument(
+        "--deep",
+        action="store_true",
+        help="Decompress every entry when verifying instead of checking the "
+        "archive structure only",
+    )
 
     args = parser.parse_args()
 
     # Load configuration
-    config_file_path = os.path.abspath(args.config)
-    with open(config_file_path, "r") as f:
-        config = json.load(f)
+    config = load_config(args.config)
 
     # Determine backup prefix and directory
     if args.type == "bitwarden":
@@ -153,7 +157,7 @@ def main():
             sys.exit(1)
         show_backup_info(backup_manager, args.filename)
     elif args.action == "verify":
-        verify_backups(backup_manager)
+        verify_backups(backup_manager, deep=args.deep)
 
 
 if __name__ == "__main__":
@@ -4,16 +4,92 @@ Shared utilities for backup scripts.
 Provides common functionality for backup management, verification, and rotation.
 """
 
+import atexit
 import hashlib
+import heapq
 import json
 import logging
 import os
+import pickle
+import queue
 import shutil
-import subprocess
+import stat
 import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pyzipper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+else:
+    # Let pyzipper deflate/inflate and CRC with the SIMD-accelerated zlib-ng
+    pyzipper.zipfile.zlib = zlib_ng
+    pyzipper.zipfile.crc32 = zlib_ng.crc32
+
+logger = logging.getLogger(__name__)
+
+CONFIG_CACHE_DIR = os.path.expanduser("~/.cache/backup-scripts")
+
+# Read size used when hashing files without hashlib.file_digest
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Number of backups verified concurrently by verify_all_backups()
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+
+# Read-ahead used when archiving directory trees
+PREFETCH_WORKERS = min(8, os.cpu_count() or 1)
+PREFETCH_MAX_FILE_SIZE = 1024 * 1024
+
+# Staging directories for archives being written, inside the backup directory;
+# ones untouched for this many seconds were left behind by a killed run
+STAGING_PREFIX = ".backup-"
+STALE_STAGING_AGE = 60 * 60
+
+# Formats that are already compressed; deflating them again only burns CPU
+STORED_EXTENSIONS = frozenset(
+    {
+        ".7z",
+        ".avi",
+        ".bz2",
+        ".docx",
+        ".gif",
+        ".gz",
+        ".heic",
+        ".jpeg",
+        ".jpg",
+        ".m4a",
+        ".mkv",
+        ".mov",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".pdf",
+        ".png",
+        ".pptx",
+        ".webm",
+        ".webp",
+        ".xlsx",
+        ".xz",
+        ".zip",
+        ".zst",
+    }
+)
+
+# Background thread writing log records, see setup_logging()
+_log_listener: Optional[QueueListener] = None
 
 
 class BackupManager:
@@ -27,6 +103,8 @@ class BackupManager:
         max_backups: int = 7,
         verify_backups: bool = True,
         retention_policy: Optional[Dict] = None,
+        deduplicate: bool = False,
+        compression_level: int = 6,
     ):
         """
         Initialize the BackupManager.
@@ -38,6 +116,9 @@ class BackupManager:
             max_backups: Maximum number of backups to keep (simple rotation)
             verify_backups: Whether to verify backups after creation
             retention_policy: Advanced retention policy (e.g., {"daily": 7, "weekly": 4, "monthly": 12})
+            deduplicate: Hard-link an existing backup instead of writing a new
+                archive when the source has not changed since that backup
+            compression_level: Deflate level from 0 (store only) to 9 (smallest)
         """
         self.backup_dir = os.path.expanduser(backup_dir)
         self.backup_prefix = backup_prefix
@@ -45,186 +126,547 @@ class BackupManager:
         self.max_backups = max_backups
         self.verify_backups = verify_backups
         self.retention_policy = retention_policy or {}
+
+        # Age limits (in days) of the daily and weekly retention tiers
+        self._daily_cut = int(self.retention_policy.get("daily", 0))
+        self._weekly_cut = self._daily_cut + 7 * int(
+            self.retention_policy.get("weekly", 0)
+        )
+        self.deduplicate = deduplicate
+        self.compression_level = compression_level
         self.metadata_file = os.path.join(self.backup_dir, ".backup_metadata.json")
 
+        # In-memory copy of the metadata file, written back by _flush_metadata()
+        self._metadata_cache: Optional[Dict] = None
+        self._metadata_dirty = False
+
+        # Result of list_backups(), dropped whenever backups are added/removed
+        self._backups_cache: Optional[List[Dict]] = None
+        self._backups_by_name: Dict[str, Dict] = {}
+
         # Ensure backup directory exists
-        os.makedirs(self.backup_dir, exist_ok=True)
+        Path(self.backup_dir).mkdir(parents=True, exist_ok=True)
 
     def create_encrypted_backup(
-        self, source_path: str, is_file: bool = True
+        self, source_path: str, is_file: bool = True, snapshot: bool = False
     ) -> Tuple[str, Dict]:
         """
-        Create an encrypted ZIP backup.
+        Create an AES-256 encrypted ZIP backup.
 
         Args:
             source_path: Path to file or directory to backup
             is_file: True if source_path is a file, False if directory
+            snapshot: Copy the source to a temporary location first and
+                archive the copy, for sources that may change mid-backup
 
         Returns:
             Tuple of (backup_file_path, metadata_dict)
         """
-        timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        created = datetime.now()
+        timestamp = created.strftime("%Y-%m-%d-%H-%M-%S")
         backup_filename = f"{self.backup_prefix}_{timestamp}.zip"
         backup_path = os.path.join(self.backup_dir, backup_filename)
+        source_path = os.path.abspath(source_path)
 
-        # Create temporary directory for intermediate files
-        temp_dir = tempfile.mkdtemp(prefix="backup-")
-        try:
+        # Fingerprint the source before anything is copied or written, so an
+        # unchanged source can reuse the archive of an earlier backup
+        source_checksum = None
+        tree = None
+        if self.deduplicate:
             if is_file:
-                # For files, copy to temp dir first
-                temp_source = os.path.join(temp_dir, os.path.basename(source_path))
-                shutil.copy2(source_path, temp_source)
-                zip_source = temp_source
-                zip_cwd = temp_dir
+                source_checksum = self._calculate_checksum(source_path)
             else:
-                # For directories, copy to temp dir
-                temp_source = os.path.join(
-                    temp_dir, os.path.basename(source_path.rstrip("/"))
-                )
-                shutil.copytree(source_path, temp_source)
-                zip_source = os.path.basename(temp_source)
-                zip_cwd = temp_dir
+                # Reuse the scan (and its stat results) when archiving the tree
+                tree = _scan_tree(source_path)
+                source_checksum = _fingerprint_tree(source_path, tree)
+            linked = self._link_unchanged_backup(
+                source_checksum, backup_path, backup_filename, timestamp, created
+            )
+            if linked is not None:
+                return backup_path, linked
 
-            # Create encrypted ZIP
-            zip_args = ["zip", "-P", self.zip_password, "-r", backup_path]
-            if is_file:
-                zip_args.append("-j")  # Junk paths for single file
-            zip_args.append(zip_source)
+        # Create temporary directory for intermediate files next to the backups,
+        # so the finished archive can be moved into place with a single rename
+        temp_dir = self._make_staging_dir()
+        try:
+            if snapshot:
+                snapshot_path = os.path.join(temp_dir, os.path.basename(source_path))
+                if is_file:
+                    shutil.copy2(source_path, snapshot_path)
+                else:
+                    shutil.copytree(source_path, snapshot_path)
+                source_path = snapshot_path
+                tree = None
+
+            def write_entries(zf: pyzipper.AESZipFile):
+                if is_file:
+                    zf.write(
+                        source_path,
+                        arcname=os.path.basename(source_path),
+                        compress_type=_compress_type(zf, source_path),
+                    )
+                else:
+                    self._write_directory(
+                        zf, source_path, os.path.dirname(source_path), tree
+                    )
+
+            # Create AES-256 encrypted ZIP in-process, then move it into place
+            # and persist the rename itself
+            temp_backup_path = os.path.join(temp_dir, backup_filename)
+            checksum = self._write_archive(temp_backup_path, write_entries)
+            os.replace(temp_backup_path, backup_path)
+            _fsync(self.backup_dir)
 
-            result = subprocess.run(
-                zip_args, cwd=zip_cwd, capture_output=True, text=True
+            return backup_path, self._finalize_backup(
+                backup_path,
+                backup_filename,
+                timestamp,
+                created,
+                checksum,
+                source_checksum,
             )
 
-            if result.returncode != 0:
-                raise RuntimeError(
-                    f"Failed to create encrypted backup: {result.stderr}"
-                )
+        finally:
+            # Clean up temporary directory
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
-            # Get backup metadata
-            backup_size = os.path.getsize(backup_path)
-            checksum = self._calculate_checksum(backup_path)
-
-            metadata = {
-                "filename": backup_filename,
-                "path": backup_path,
-                "timestamp": timestamp,
-                "created_at": datetime.now().isoformat(),
-                "size": backup_size,
-                "checksum": checksum,
-                "verified": False,
-            }
+    def _link_unchanged_backup(
+        self,
+        source_checksum: str,
+        backup_path: str,
+        backup_filename: str,
+        timestamp: str,
+        created: datetime,
+    ) -> Optional[Dict]:
+        """
+        Hard-link the newest backup of an identical source to backup_path.
 
-            # Verify backup if requested
-            if self.verify_backups:
-                if self.verify_backup_integrity(backup_path):
-                    metadata["verified"] = True
-                    logging.info(f"Backup verified successfully: {backup_filename}")
-                else:
-                    logging.warning(f"Backup verification failed: {backup_filename}")
-                    # Optionally remove failed backup
-                    # os.remove(backup_path)
-                    # raise RuntimeError("Backup verification failed")
+        The backup is only reused if it was written with the same
+        compression level and opens with the current password. It is also
+        verified in full now unless that already passed when it was created.
 
-            # Save metadata
-            self._save_metadata(metadata)
+        Args:
+            source_checksum: Fingerprint of the source being backed up
+            backup_path: Path of the new backup
+            backup_filename: Filename of the new backup
+            timestamp: Timestamp of the new backup
+            created: Creation time of the new backup
+
+        Returns:
+            Metadata of the new backup, or None if no backup could be reused
+        """
+        previous = next(
+            (
+                b
+                for b in self.list_backups()
+                if b.get("source_checksum") == source_checksum
+                and b.get("compression_level") == self.compression_level
+            ),
+            None,
+        )
+        if previous is None:
+            return None
+
+        # Never propagate a corrupt archive or one encrypted with an old
+        # password; the quick check is enough once the contents were verified
+        previous_path = os.path.join(self.backup_dir, previous["filename"])
+        if not self.verify_backup_integrity(
+            previous_path, deep=not previous.get("verified")
+        ):
+            logger.warning(
+                "Not reusing backup that failed verification: %s",
+                previous["filename"],
+            )
+            return None
+        previous = {**previous, "verified": True}
+
+        try:
+            os.link(previous_path, backup_path)
+        except OSError as e:
+            logger.warning(
+                "Failed to link unchanged backup %s: %s", previous["filename"], e
+            )
+            return None
+        _fsync(self.backup_dir)
+
+        metadata = {k: v for k, v in previous.items() if not k.startswith("_")}
+        metadata.update(
+            filename=backup_filename,
+            path=backup_path,
+            timestamp=timestamp,
+            created_at=created.isoformat(),
+        )
+        logger.info(
+            "Source unchanged since %s, linked it as %s",
+            previous["filename"],
+            backup_filename,
+        )
+
+        self._save_metadata(metadata)
+        self._flush_metadata()
+        return metadata
+
+    def _write_directory(
+        self,
+        zf: pyzipper.AESZipFile,
+        source_dir: str,
+        base_dir: str,
+        tree: Optional[List[Tuple[str, os.stat_result]]] = None,
+    ):
+        """
+        Add a directory tree to an open archive.
+
+        Small files are read ahead on a thread pool, so their open/read
+        latency overlaps with compressing and encrypting earlier entries.
+        Entries are still written in order by the calling thread.
 
-            return backup_path, metadata
+        Args:
+            zf: Archive opened for writing
+            source_dir: Directory to add
+            base_dir: Directory that archive names are relative to
+            tree: Result of _scan_tree(source_dir), if already available
+        """
+        if tree is None:
+            tree = _scan_tree(source_dir)
 
+        with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+            pending = deque()
+            for path, st in tree:
+                pending.append((path, st, executor.submit(_read_small_file, path, st)))
+                # Bound the read-ahead window to keep memory usage flat
+                if len(pending) > 2 * PREFETCH_WORKERS:
+                    self._write_entry(zf, base_dir, *pending.popleft())
+            while pending:
+                self._write_entry(zf, base_dir, *pending.popleft())
+
+    @staticmethod
+    def _write_entry(
+        zf: pyzipper.AESZipFile,
+        base_dir: str,
+        path: str,
+        st: os.stat_result,
+        data_future: Future,
+    ):
+        """Write one entry, streaming it from disk if it was not prefetched."""
+        arcname = os.path.relpath(path, base_dir)
+        data = data_future.result()
+        compress_type = _compress_type(zf, path)
+        if data is None:
+            zf.write(path, arcname=arcname, compress_type=compress_type)
+        else:
+            zinfo = _zipinfo_from_stat(zf, arcname, st)
+            zinfo.compress_type = compress_type
+            zinfo._compresslevel = zf.compresslevel
+            zf.writestr(zinfo, data)
+
+    def create_encrypted_backup_from_stream(
+        self, chunks: Iterable[bytes], extension: str
+    ) -> Tuple[str, Dict]:
+        """
+        Create an AES-256 encrypted ZIP backup from a stream of bytes.
+
+        The data is written straight into the archive, so no plaintext copy
+        ever touches the disk.
+
+        Args:
+            chunks: Iterable of byte chunks to store (e.g. read from a pipe)
+            extension: Extension of the archived entry (e.g. ".json")
+
+        Returns:
+            Tuple of (backup_file_path, metadata_dict)
+        """
+        created = datetime.now()
+        timestamp = created.strftime("%Y-%m-%d-%H-%M-%S")
+        backup_filename = f"{self.backup_prefix}_{timestamp}.zip"
+        backup_path = os.path.join(self.backup_dir, backup_filename)
+        arcname = f"{self.backup_prefix}_{timestamp}{extension}"
+
+        def write_entries(zf: pyzipper.AESZipFile):
+            with zf.open(arcname, "w", force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+
+        # Write under a temporary directory and rename into place, so a killed
+        # export never leaves a truncated archive that looks like a backup
+        temp_dir = self._make_staging_dir()
+        try:
+            temp_backup_path = os.path.join(temp_dir, backup_filename)
+            checksum = self._write_archive(temp_backup_path, write_entries)
+            os.replace(temp_backup_path, backup_path)
+            _fsync(self.backup_dir)
         finally:
-            # Clean up temporary directory
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return backup_path, self._finalize_backup(
+            backup_path, backup_filename, timestamp, created, checksum
+        )
+
+    def _make_staging_dir(self) -> str:
+        """
+        Create a staging directory in the backup directory.
+
+        Staging directories left behind by killed runs are removed first,
+        as nothing else ever cleans them up.
+
+        Returns:
+            Path of the new staging directory
+        """
+        cutoff = time.time() - STALE_STAGING_AGE
+        with os.scandir(self.backup_dir) as it:
+            staging_dirs = [
+                entry.path
+                for entry in it
+                if entry.name.startswith(STAGING_PREFIX)
+                and entry.is_dir(follow_symlinks=False)
+            ]
+        for path in staging_dirs:
+            if _last_modified(path) < cutoff:
+                logger.info("Removing stale staging directory: %s", path)
+                shutil.rmtree(path, ignore_errors=True)
+
+        return tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.backup_dir)
+
+    def _write_archive(
+        self,
+        archive_path: str,
+        write_entries: Callable[[pyzipper.AESZipFile], None],
+    ) -> str:
+        """
+        Write an AES-256 encrypted ZIP and fsync it.
+
+        The archive is hashed as it is written, so its checksum comes for
+        free instead of from a second read of the finished file.
+
+        Args:
+            archive_path: Path of the archive to create
+            write_entries: Callback adding the entries to the open archive
+
+        Returns:
+            SHA256 checksum of the archive
+        """
+        # Buffered, so zipfile's many small header and chunk writes are batched
+        # into large write(2) calls (and short writes are retried)
+        with open(archive_path, "wb") as f:
+            writer = _HashingWriter(f)
+            with pyzipper.AESZipFile(
+                writer,
+                "w",
+                compression=(
+                    pyzipper.ZIP_DEFLATED
+                    if self.compression_level
+                    else pyzipper.ZIP_STORED
+                ),
+                compresslevel=self.compression_level,
+                encryption=pyzipper.WZ_AES,
+            ) as zf:
+                zf.setpassword(self.zip_password.encode())
+                write_entries(zf)
+            f.flush()
+            os.fsync(f.fileno())
+        return writer.hexdigest()
+
+    def _finalize_backup(
+        self,
+        backup_path: str,
+        backup_filename: str,
+        timestamp: str,
+        created: datetime,
+        checksum: str,
+        source_checksum: Optional[str] = None,
+    ) -> Dict:
+        """Collect, verify and save metadata for a freshly written backup."""
+        backup_size = os.path.getsize(backup_path)
 
-    def verify_backup_integrity(self, backup_path: str) -> bool:
+        metadata = {
+            "filename": backup_filename,
+            "path": backup_path,
+            "timestamp": timestamp,
+            "created_at": created.isoformat(),
+            "size": backup_size,
+            "checksum": checksum,
+            "source_checksum": source_checksum,
+            "compression_level": self.compression_level,
+            "verified": False,
+        }
+
+        # Verify backup if requested
+        if self.verify_backups:
+            if self.verify_backup_integrity(backup_path, deep=True):
+                metadata["verified"] = True
+                logger.info("Backup verified successfully: %s", backup_filename)
+            else:
+                logger.warning("Backup verification failed: %s", backup_filename)
+                # Optionally remove failed backup
+                # os.remove(backup_path)
+                # raise RuntimeError("Backup verification failed")
+
+        # Save metadata
+        self._save_metadata(metadata)
+        self._flush_metadata()
+
+        # The archive is not read again by this process
+        _drop_page_cache(backup_path)
+
+        return metadata
+
+    def verify_backup_integrity(self, backup_path: str, *, deep: bool = False) -> bool:
         """
         Verify the integrity of a backup file.
 
+        The quick check parses the ZIP central directory, which catches
+        truncated or damaged archives, and opens one entry to check its
+        local header and the password. The deep check decrypts and
+        decompresses every entry to compare it against its checksum, which
+        reads the whole archive.
+
         Args:
             backup_path: Path to the backup file
+            deep: Check the contents of every entry, not just the structure
 
         Returns:
             True if backup is valid, False otherwise
         """
         if not os.path.exists(backup_path):
-            logging.error(f"Backup file does not exist: {backup_path}")
+            logger.error("Backup file does not exist: %s", backup_path)
             return False
 
-        # Test ZIP integrity
-        result = subprocess.run(
-            ["unzip", "-t", "-P", self.zip_password, backup_path],
-            capture_output=True,
-            text=True,
-        )
+        try:
+            with pyzipper.AESZipFile(backup_path) as zf:
+                zf.setpassword(self.zip_password.encode())
+                if deep:
+                    bad_entry = zf.testzip()
+                else:
+                    bad_entry = None
+                    files = [info for info in zf.infolist() if not info.is_dir()]
+                    if files:
+                        zf.open(files[0]).close()
+        except Exception as e:
+            # A damaged archive can trip arbitrary errors inside the parser
+            # (e.g. KeyError on a corrupt AES header); they all mean invalid
+            logger.error("ZIP integrity check failed: %r", e)
+            return False
 
-        if result.returncode != 0:
-            logging.error(f"ZIP integrity check failed: {result.stderr}")
+        if bad_entry is not None:
+            logger.error("ZIP integrity check failed: corrupt entry %s", bad_entry)
             return False
 
         return True
 
     def _calculate_checksum(self, file_path: str, algorithm: str = "sha256") -> str:
         """Calculate checksum of a file."""
-        hash_obj = hashlib.new(algorithm)
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+        with open(file_path, "rb", buffering=0) as f:
+            if hasattr(hashlib, "file_digest"):
+                # Python 3.11+: hashes in C with a reused buffer, GIL released
+                return hashlib.file_digest(f, algorithm).hexdigest()
+            hash_obj = hashlib.new(algorithm)
+            for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
                 hash_obj.update(chunk)
         return hash_obj.hexdigest()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Write any pending metadata changes when leaving a `with` block."""
+        self._flush_metadata()
+
     def _save_metadata(self, metadata: Dict):
-        """Save backup metadata to JSON file."""
+        """Record backup metadata; written to disk by _flush_metadata()."""
         all_metadata = self._load_metadata()
-        all_metadata[metadata["filename"]] = metadata
-        with open(self.metadata_file, "w") as f:
-            json.dump(all_metadata, f, indent=2)
+        # Drop in-memory helper fields such as "_created_dt" (not JSON-serializable)
+        all_metadata[metadata["filename"]] = {
+            k: v for k, v in metadata.items() if not k.startswith("_")
+        }
+        self._metadata_dirty = True
+        self._backups_cache = None
+
+    def _flush_metadata(self):
+        """
+        Write pending metadata changes to the JSON file.
+
+        The file is written under a temporary name and renamed over the old
+        one, so an interrupted write never leaves truncated metadata behind.
+        """
+        if not self._metadata_dirty:
+            return
+        temp_file = self.metadata_file + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(_json_dumps(self._metadata_cache))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.metadata_file)
+        _fsync(self.backup_dir)
+        self._metadata_dirty = False
 
     def _load_metadata(self) -> Dict:
-        """Load backup metadata from JSON file."""
+        """Load backup metadata, reading the JSON file only on first use."""
+        if self._metadata_cache is None:
+            self._metadata_cache = self._read_metadata_file()
+        return self._metadata_cache
+
+    def _read_metadata_file(self) -> Dict:
+        """Read backup metadata from JSON file."""
         if os.path.exists(self.metadata_file):
             try:
-                with open(self.metadata_file, "r") as f:
-                    return json.load(f)
+                with open(self.metadata_file, "rb") as f:
+                    return _json_loads(f.read())
             except (json.JSONDecodeError, IOError) as e:
-                logging.warning(f"Failed to load metadata: {e}")
+                logger.warning("Failed to load metadata: %s", e)
                 return {}
         return {}
 
     def list_backups(self) -> List[Dict]:
-        """List all backups with their metadata."""
+        """List all backups with their metadata (cached until backups change)."""
+        if self._backups_cache is not None:
+            return self._backups_cache
+
+        backups = self._scan_backups()
+
+        # Sort by creation time (newest first)
+        backups.sort(key=_created_at_key, reverse=True)
+
+        self._backups_cache = backups
+        self._backups_by_name = {b["filename"]: b for b in backups}
+        return backups
+
+    def _scan_backups(self) -> List[Dict]:
+        """Collect metadata for all backups in the backup directory, unsorted."""
         all_metadata = self._load_metadata()
         backups = []
 
-        # Get all backup files
-        backup_files = [
-            f
-            for f in os.listdir(self.backup_dir)
-            if f.startswith(self.backup_prefix) and f.endswith(".zip")
-        ]
+        # Get all backup files in a single directory scan
+        with os.scandir(self.backup_dir) as it:
+            entries = [
+                entry
+                for entry in it
+                if entry.name.startswith(self.backup_prefix)
+                and entry.name.endswith(".zip")
+                and entry.is_file()
+            ]
 
-        for backup_file in backup_files:
-            backup_path = os.path.join(self.backup_dir, backup_file)
+        for entry in entries:
+            backup_file = entry.name
+            backup_path = entry.path
             if backup_file in all_metadata:
+                # Backups are written once, so the recorded size stays valid
                 metadata = all_metadata[backup_file].copy()
+                if "size" not in metadata:
+                    metadata["size"] = entry.stat().st_size
             else:
                 # Generate metadata for files not in metadata file
+                st = entry.stat()
                 metadata = {
                     "filename": backup_file,
                     "path": backup_path,
                     "timestamp": self._extract_timestamp(backup_file),
-                    "created_at": datetime.fromtimestamp(
-                        os.path.getmtime(backup_path)
-                    ).isoformat(),
-                    "size": os.path.getsize(backup_path),
+                    "created_at": datetime.fromtimestamp(st.st_mtime).isoformat(),
+                    "size": st.st_size,
                     "checksum": None,
                     "verified": False,
                 }
 
-            # Update size if it changed
-            if os.path.exists(backup_path):
-                metadata["size"] = os.path.getsize(backup_path)
-                backups.append(metadata)
+            backups.append(metadata)
 
-        # Sort by creation time (newest first)
-        backups.sort(key=lambda x: x.get("created_at", ""), reverse=True)
         return backups
 
     def _extract_timestamp(self, filename: str) -> str:
@@ -249,19 +691,32 @@ class BackupManager:
             self._rotate_with_policy()
         else:
             self._rotate_simple()
+        self._flush_metadata()
 
     def _rotate_simple(self):
         """Simple rotation: keep only the N most recent backups."""
-        backups = self.list_backups()
-        if len(backups) > self.max_backups:
-            backups_to_delete = backups[self.max_backups :]
-            for backup in backups_to_delete:
-                backup_path = backup["path"]
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                    logging.info(f"Deleted old backup: {backup['filename']}")
-                    # Remove from metadata
-                    self._remove_from_metadata(backup["filename"])
+        backups = self._scan_backups()
+        excess = len(backups) - self.max_backups
+        if excess > 0:
+            # Select the oldest backups; a bounded heap beats a full sort
+            # when only a few of many backups have to go
+            if excess < len(backups) // 4:
+                backups_to_delete = heapq.nsmallest(
+                    excess, backups, key=_created_at_key
+                )
+            else:
+                backups_to_delete = sorted(backups, key=_created_at_key)[:excess]
+            self._delete_backups(backups_to_delete)
+
+    @staticmethod
+    def _created_dt(backup: Dict) -> datetime:
+        """Parse a backup's created_at once and keep the result on the dict."""
+        created = backup.get("_created_dt")
+        if created is None:
+            created = backup["_created_dt"] = datetime.fromisoformat(
+                backup["created_at"]
+            )
+        return created
 
     def _rotate_with_policy(self):
         """Advanced rotation based on retention policy."""
@@ -269,124 +724,447 @@ class BackupManager:
         if not backups:
             return
 
-        # Group backups by date
+        # Compute every backup's age up front so bucketing works on plain ints
         now = datetime.now()
-        to_keep = []
-        to_delete = []
-
+        ages: List[Optional[int]] = []
         for backup in backups:
             try:
-                created = datetime.fromisoformat(backup["created_at"])
-                age_days = (now - created).days
+                ages.append((now - self._created_dt(backup)).days)
+            except Exception as e:
+                logger.warning("Error processing backup %s: %s", backup["filename"], e)
+                ages.append(None)
+
+        to_keep = []
+        to_delete = []
+        kept_weeks = set()
+        kept_months = set()
 
-                # Determine which category this backup falls into
-                if age_days == 0:
-                    # Today's backup - always keep
+        for backup, age_days in zip(backups, ages):
+            # Determine which category this backup falls into
+            if age_days is None:
+                to_delete.append(backup)
+            elif age_days == 0 or age_days <= self._daily_cut:
+                # Today's backup and daily backups - always keep
+                to_keep.append(backup)
+            elif age_days <= self._weekly_cut:
+                # Weekly backups - keep one per week
+                week_num = age_days // 7
+                if week_num not in kept_weeks:
+                    kept_weeks.add(week_num)
                     to_keep.append(backup)
-                elif age_days <= self.retention_policy.get("daily", 0):
-                    # Daily backups
+                else:
+                    to_delete.append(backup)
+            else:
+                # Monthly backups - keep one per month
+                month_num = age_days // 30
+                if month_num not in kept_months:
+                    kept_months.add(month_num)
                     to_keep.append(backup)
-                elif age_days <= self.retention_policy.get("daily", 0) + (
-                    self.retention_policy.get("weekly", 0) * 7
-                ):
-                    # Weekly backups - keep one per week
-                    week_num = age_days // 7
-                    if week_num not in [b.get("week_num") for b in to_keep]:
-                        backup["week_num"] = week_num
-                        to_keep.append(backup)
-                    else:
-                        to_delete.append(backup)
                 else:
-                    # Monthly backups - keep one per month
-                    month_num = age_days // 30
-                    if month_num not in [b.get("month_num") for b in to_keep]:
-                        backup["month_num"] = month_num
-                        to_keep.append(backup)
-                    else:
-                        to_delete.append(backup)
+                    to_delete.append(backup)
 
-            except Exception as e:
-                logging.warning(f"Error processing backup {backup['filename']}: {e}")
-                to_delete.append(backup)
+        # Track decisions by identity: O(1) lookups instead of comparing dicts
+        kept_ids = {id(b) for b in to_keep}
+        deleted_ids = {id(b) for b in to_delete}
 
         # Ensure we keep at least max_backups
         if len(to_keep) < self.max_backups:
             # Add more recent backups to keep list
-            remaining = [b for b in backups if b not in to_keep and b not in to_delete]
+            remaining = [
+                b for b in backups if id(b) not in kept_ids and id(b) not in deleted_ids
+            ]
             to_keep.extend(remaining[: self.max_backups - len(to_keep)])
+            kept_ids.update(id(b) for b in to_keep)
 
         # Delete backups not in keep list
+        self._delete_backups([b for b in backups if id(b) not in kept_ids])
+
+    def _delete_backups(self, backups: List[Dict]):
+        """Delete backup files and their metadata, logging one summary line."""
+        deleted = []
         for backup in backups:
-            if backup not in to_keep:
-                backup_path = backup["path"]
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                    logging.info(f"Deleted old backup: {backup['filename']}")
-                    self._remove_from_metadata(backup["filename"])
+            try:
+                os.unlink(backup["path"])
+            except FileNotFoundError:
+                continue
+            deleted.append(backup["filename"])
+            # Remove from metadata
+            self._remove_from_metadata(backup["filename"])
+
+        if deleted:
+            # Persist all removals with a single directory sync
+            _fsync(self.backup_dir)
+            logger.info(
+                "Deleted %d old backup(s): %s", len(deleted), ", ".join(deleted)
+            )
 
     def _remove_from_metadata(self, filename: str):
-        """Remove a backup from metadata file."""
+        """Remove a backup from metadata; written to disk by _flush_metadata()."""
         all_metadata = self._load_metadata()
         if filename in all_metadata:
             del all_metadata[filename]
-            with open(self.metadata_file, "w") as f:
-                json.dump(all_metadata, f, indent=2)
+            self._metadata_dirty = True
+        self._backups_cache = None
 
     def get_backup_info(self, filename: str) -> Optional[Dict]:
         """Get detailed information about a specific backup."""
-        backups = self.list_backups()
-        for backup in backups:
-            if backup["filename"] == filename:
-                return backup
-        return None
+        self.list_backups()
+        return self._backups_by_name.get(filename)
+
+    def verify_all_backups(self, deep: bool = False) -> Dict[str, bool]:
+        """
+        Verify integrity of all backups, several at a time.
 
-    def verify_all_backups(self) -> Dict[str, bool]:
-        """Verify integrity of all backups."""
+        Args:
+            deep: Check every entry's contents (see verify_backup_integrity)
+
+        Returns:
+            Dict mapping backup filenames to whether they are valid
+        """
         backups = self.list_backups()
-        results = {}
-        for backup in backups:
+
+        def verify(backup: Dict) -> bool:
             backup_path = backup["path"]
             if os.path.exists(backup_path):
-                results[backup["filename"]] = self.verify_backup_integrity(backup_path)
-            else:
-                results[backup["filename"]] = False
-        return results
+                return self.verify_backup_integrity(backup_path, deep=deep)
+            return False
+
+        # Decompression, AES and HMAC all run in C and release the GIL,
+        # so threads are enough to verify archives in parallel
+        with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as executor:
+            return {
+                backup["filename"]: is_valid
+                for backup, is_valid in zip(backups, executor.map(verify, backups))
+            }
+
+
+def _json_loads(data: bytes):
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to indented JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+
+class _HashingWriter:
+    """
+    Write-only file wrapper that hashes everything written through it.
+
+    It deliberately cannot seek, so ZipFile writes each entry once (using
+    data descriptors) instead of seeking back to patch local headers, and
+    the running hash matches the bytes on disk.
+    """
+
+    def __init__(self, fp, algorithm: str = "sha256"):
+        self._fp = fp
+        self._hash = hashlib.new(algorithm)
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self._fp.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        self._fp.flush()
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def _compress_type(zf: pyzipper.AESZipFile, path: str) -> int:
+    """Store files in STORED_EXTENSIONS as is, compress everything else."""
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return pyzipper.ZIP_STORED
+    return zf.compression
+
+
+def _created_at_key(backup: Dict) -> str:
+    """Sort key ordering backups by creation time."""
+    return backup.get("created_at", "")
+
+
+def _read_small_file(path: str, st: os.stat_result) -> Optional[bytes]:
+    """Read a regular file up to PREFETCH_MAX_FILE_SIZE, otherwise return None."""
+    if not stat.S_ISREG(st.st_mode) or st.st_size > PREFETCH_MAX_FILE_SIZE:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _scan_tree(source_dir: str) -> List[Tuple[str, os.stat_result]]:
+    """
+    List a directory tree with one stat per entry.
+
+    Entries come in os.walk() order (top-down, directories before files,
+    both sorted by name). Symlinks are followed, so linked directories are
+    archived with their contents like a copy of the tree would be; each
+    directory is descended into only once, which also stops symlink loops.
+    The stat results are reused for fingerprinting and for the archive
+    entries' headers, so no entry is stat()ed twice.
+
+    Args:
+        source_dir: Directory to scan
+
+    Returns:
+        List of (path, stat_result) tuples, excluding source_dir itself
+    """
+    root = os.stat(source_dir)
+    visited = {(root.st_dev, root.st_ino)}
+    tree = []
+    stack = [source_dir]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir():
+                st = entry.stat()
+                tree.append((entry.path, st))
+                if (st.st_dev, st.st_ino) not in visited:
+                    visited.add((st.st_dev, st.st_ino))
+                    subdirs.append(entry.path)
+        for entry in entries:
+            if not entry.is_dir():
+                tree.append((entry.path, entry.stat()))
+        stack.extend(reversed(subdirs))
+    return tree
+
+
+def _zipinfo_from_stat(
+    zf: pyzipper.AESZipFile, arcname: str, st: os.stat_result
+) -> pyzipper.ZipInfo:
+    """Build a regular file's ZipInfo like ZipInfo.from_file, without a stat."""
+    zinfo = zf.zipinfo_cls(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16  # Unix attributes
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def _fingerprint_tree(source_dir: str, tree: List[Tuple[str, os.stat_result]]) -> str:
+    """
+    Fingerprint a directory tree from its entries' paths, sizes and mtimes.
+
+    This only needs the stat results from _scan_tree(), so it is far cheaper
+    than hashing the contents while still changing whenever a file is
+    added, removed or modified.
+
+    Args:
+        source_dir: Directory that was scanned
+        tree: Result of _scan_tree(source_dir)
+
+    Returns:
+        SHA256 hex digest of the tree listing
+    """
+    hash_obj = hashlib.sha256()
+    for path, st in tree:
+        relpath = os.path.relpath(path, source_dir)
+        hash_obj.update(
+            f"{relpath}\0{st.st_size}\0{st.st_mtime_ns}\n".encode(
+                "utf-8", "surrogateescape"
+            )
+        )
+    return hash_obj.hexdigest()
+
+
+def _last_modified(path: str) -> float:
+    """Latest mtime of a directory and its direct entries (0 if it is gone)."""
+    try:
+        latest = os.stat(path).st_mtime
+        with os.scandir(path) as it:
+            for entry in it:
+                latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+    except OSError:
+        return 0.0
+    return latest
+
+
+def _fsync(path: str):
+    """Flush a file's (or a directory's entries') data to stable storage."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _drop_page_cache(path: str):
+    """Advise the kernel to evict a file's pages from the page cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _is_private_dir(path: str) -> bool:
+    """Whether path is a directory owned by us that others cannot write to."""
+    if not hasattr(os, "getuid"):
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and st.st_mode & 0o022 == 0
+    )
+
+
+def load_config(config_file_path: str) -> Dict:
+    """
+    Load a JSON configuration file.
+
+    The parsed configuration is cached as a pickle under CONFIG_CACHE_DIR,
+    keyed by the config file's path, mtime and size, so repeated runs with
+    an unchanged config skip JSON parsing.
+
+    Args:
+        config_file_path: Path to the configuration JSON file
+
+    Returns:
+        Configuration dictionary
+    """
+    config_file_path = os.path.abspath(config_file_path)
+    st = os.stat(config_file_path)
+    cache_key = (config_file_path, st.st_mtime_ns, st.st_size)
+    cache_file = os.path.join(
+        CONFIG_CACHE_DIR,
+        hashlib.sha256(config_file_path.encode()).hexdigest()[:16] + ".pkl",
+    )
+
+    # The cache holds secrets and is unpickled, so only trust a directory
+    # that nobody else can write to
+    if _is_private_dir(CONFIG_CACHE_DIR):
+        try:
+            with open(cache_file, "rb") as f:
+                cached_key, config = pickle.load(f)
+            if cached_key == cache_key:
+                return config
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            pass
+
+    with open(config_file_path, "rb") as f:
+        config = _json_loads(f.read())
+
+    # Rewrite the cache atomically; the config holds secrets, so keep it 0600
+    try:
+        os.makedirs(CONFIG_CACHE_DIR, mode=0o700, exist_ok=True)
+        if not _is_private_dir(CONFIG_CACHE_DIR):
+            return config
+        fd, tmp_path = tempfile.mkstemp(dir=CONFIG_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((cache_key, config), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_file)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        pass
+
+    return config
 
 
 def setup_logging(log_file_path: str, level: int = logging.INFO):
     """
     Setup logging configuration.
 
+    Records are handed to a queue and written to the log file and console
+    by a background listener thread, so logging never blocks on disk I/O.
+
     Args:
         log_file_path: Path to log file
         level: Logging level
     """
-    os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+    Path(log_file_path).parent.mkdir(parents=True, exist_ok=True)
+
+    formatter = logging.Formatter(
+        fmt="%(asctime)s.%(msecs)03d [%(levelname)-8s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    file_handler = logging.FileHandler(log_file_path)
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    global _log_listener
+    if _log_listener is None:
+        atexit.register(shutdown_logging)
+    else:
+        # Reconfiguring: drain the old listener and close its handlers
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+
+    log_queue = queue.Queue(-1)
+    _log_listener = QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+
+    queue_handler = QueueHandler(log_queue)
+    # Only merge args into the message here; the listener's handlers format it
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
     logging.basicConfig(
         level=level,
-        format="%(asctime)s.%(msecs)03d [%(levelname)-8s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        handlers=[logging.FileHandler(log_file_path), logging.StreamHandler()],
+        handlers=[queue_handler],
         force=True,  # Override any existing configuration
     )
 
 
+def shutdown_logging():
+    """
+    Flush and stop the logging listener started by setup_logging().
+
+    Runs automatically at interpreter exit; call it explicitly before
+    replacing the process (e.g. with os.execv), which skips atexit handlers.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    logging.shutdown()
+
+
 def validate_config(
-    config: Dict, required_keys: List[str]
+    config: Dict, required_keys: Iterable[str]
 ) -> Tuple[bool, Optional[str]]:
     """
     Validate configuration dictionary.
 
     Args:
         config: Configuration dictionary
-        required_keys: List of required keys
+        required_keys: Collection of required keys
 
     Returns:
         Tuple of (is_valid, error_message)
     """
-    missing_keys = [key for key in required_keys if key not in config]
+    missing_keys = frozenset(required_keys).difference(config)
     if missing_keys:
-        return False, f"Missing required configuration keys: {', '.join(missing_keys)}"
+        return (
+            False,
+            f"Missing required configuration keys: {', '.join(sorted(missing_keys))}",
+        )
 
     # Validate paths
     if "BACKUP_DIR_PATH" in config:
@@ -404,4 +1182,23 @@ def validate_config(
         except (ValueError, TypeError):
             return False, "MAX_BACKUPS must be a valid integer"
 
+    # Validate retention policy (the tiers are counts of days/weeks/months)
+    retention_policy = config.get("RETENTION_POLICY")
+    if retention_policy is not None:
+        if not isinstance(retention_policy, dict):
+            return False, "RETENTION_POLICY must be an object"
+        for tier in ("daily", "weekly", "monthly"):
+            count = retention_policy.get(tier, 0)
+            if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                return (
+                    False,
+                    f"RETENTION_POLICY.{tier} must be a non-negative integer",
+                )
+
+    # Validate compression level (passed to zlib as is)
+    if "COMPRESSION_LEVEL" in config:
+        level = config["COMPRESSION_LEVEL"]
+        if not isinstance(level, int) or isinstance(level, bool) or not 0 <= level <= 9:
+            return False, "COMPRESSION_LEVEL must be an integer from 0 to 9"
+
     return True, None